@@ -1,12 +1,20 @@
 import os
-import json
+import orjson
+import logging
 import base64
+import concurrent.futures
+from collections import OrderedDict
+import time
+import threading
+import re
+from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import boto3
-from nacl.signing import VerifyKey
+from botocore.config import Config
+from nacl.bindings import crypto_sign_open, crypto_sign_BYTES, crypto_sign_PUBLICKEYBYTES
 from nacl.exceptions import BadSignatureError
-import urllib.request
-from urllib.error import URLError
 
 # Discord bot configuration
 PUBLIC_KEY = os.environ.get('DISCORD_PUBLIC_KEY')
@@ -15,86 +23,297 @@ APPLICATION_ID = os.environ.get('APPLICATION_ID')
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 api_key = os.environ.get('API_KEY')
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-users_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+logger = logging.getLogger()
+_LOG_LEVEL = logging.getLevelName(os.environ.get('LOG_LEVEL', 'INFO').upper())
+# An unknown name comes back as a string; fall back rather than fail every cold start
+logger.setLevel(_LOG_LEVEL if isinstance(_LOG_LEVEL, int) else logging.INFO)
+
+# The public key never changes for the life of the container, so decode it once
+_PUB_KEY_BYTES = bytes.fromhex(PUBLIC_KEY) if PUBLIC_KEY else None
+if _PUB_KEY_BYTES is not None and len(_PUB_KEY_BYTES) != crypto_sign_PUBLICKEYBYTES:
+    raise ValueError(f"DISCORD_PUBLIC_KEY must be {crypto_sign_PUBLICKEYBYTES} bytes")
+
+# Response pieces shared by every invocation; the Lambda runtime never mutates them
+_STD_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+}
+_PING_RESPONSE = {
+    'statusCode': 200,
+    'headers': _STD_HEADERS,
+    'body': '{"type":1}'
+}
+
+# Static command data, built once per container
+_SHOP_ITEMS = {
+    "item1": 10,
+    "item2": 20,
+    "item3": 30
+}
+_SHOP_LIST_TEXT = "\n".join(f"{item}: {price} tokens" for item, price in _SHOP_ITEMS.items())
+
+_TOKEN_MAPPING = {
+    "Plastic": 1,
+    "Paper": 1,
+    "Glass": 2,
+    "Metal": 3,
+    "Organic": 1,
+    "Textile": 2,
+    "Electronic": 4,
+    "Wood": 2,
+    "Rubber": 3,
+    "Ceramic": 2,
+    "Composite": 2,
+    "Hazardous": 5,
+    "Medical": 4,
+    "Miscellaneous": 1
+}
+# One pass over the model's reply. Only the start of a word is anchored, so inflected
+# forms ("Glasses", "Wooden", "Metallic") still count, as they did with substring checks
+_WASTE_RE = re.compile(r'\b(' + '|'.join(map(re.escape, _TOKEN_MAPPING)) + r')')
+
+_SUBMIT_IMAGE_PROMPT = (
+    "Determine the waste in this image and provide the respective tokens to the user:\n\n"
+    "Plastic Waste (1 token):\n"
+    "Plastic bottles\n"
+    "Plastic bags\n"
+    "Food packaging\n"
+    "Straws\n\n"
+    "Paper Waste (1 token):\n"
+    "Newspapers\n"
+    "Magazines\n"
+    "Office paper\n"
+    "Cardboard\n\n"
+    "Glass Waste (2 tokens):\n"
+    "Glass bottles\n"
+    "Jars\n"
+    "Broken glass\n\n"
+    "Metal Waste (3 tokens):\n"
+    "Aluminum cans\n"
+    "Tin cans\n"
+    "Scrap metal\n\n"
+    "Organic Waste (1 token):\n"
+    "Food scraps\n"
+    "Fruit and vegetable peels\n"
+    "Coffee grounds\n"
+    "Yard clippings\n\n"
+    "Textile Waste (2 tokens):\n"
+    "Old clothes\n"
+    "Fabric scraps\n"
+    "Shoes\n\n"
+    "Electronic Waste (E-Waste) (4 tokens):\n"
+    "Old phones\n"
+    "Computers\n"
+    "Batteries\n"
+    "Chargers\n\n"
+    "Wood Waste (2 tokens):\n"
+    "Furniture\n"
+    "Wooden pallets\n"
+    "Tree branches\n\n"
+    "Rubber Waste (3 tokens):\n"
+    "Old tires\n"
+    "Rubber bands\n"
+    "Rubber mats\n\n"
+    "Ceramic Waste (2 tokens):\n"
+    "Broken dishes\n"
+    "Tiles\n"
+    "Pottery\n\n"
+    "Composite Waste (2 tokens):\n"
+    "Tetra packs (juice boxes)\n"
+    "Mixed-material packaging\n\n"
+    "Hazardous Household Waste (5 tokens):\n"
+    "Paints and solvents\n"
+    "Pesticides\n"
+    "Cleaning agents\n"
+    "Fluorescent bulbs\n\n"
+    "Medical Waste (4 tokens):\n"
+    "Used bandages\n"
+    "Syringes\n"
+    "Expired medications\n\n"
+    "Miscellaneous Waste (1 token):\n"
+    "Disposable diapers\n"
+    "Cigarette butts\n"
+    "Styrofoam product"
+)
+
+# Low-level DynamoDB client, created on first use so PING/shop requests skip the botocore setup
+_DDB = None
+_DDB_LOCK = threading.Lock()
+# Timeouts mirror _TIMEOUT so DynamoDB and the Lambda self-invoke are capped like the HTTP calls
+_BOTO_CONFIG = Config(
+    max_pool_connections=10,
+    connect_timeout=3,
+    read_timeout=5,
+    retries={'mode': 'adaptive', 'total_max_attempts': 3}
+)
+_BATCH_GET_LIMIT = 100
+_BATCH_GET_ATTEMPTS = 5
+_BATCH_GET_BACKOFF = 0.05
+
+_LAMBDA = None
+_LAMBDA_LOCK = threading.Lock()
+
+def _lambda_client():
+    global _LAMBDA
+    if _LAMBDA is None:
+        with _LAMBDA_LOCK:
+            if _LAMBDA is None:
+                _LAMBDA = boto3.client('lambda', config=_BOTO_CONFIG)
+    return _LAMBDA
+
+def _ddb():
+    global _DDB
+    if _DDB is None:
+        # Handlers may first touch DynamoDB from an executor thread
+        with _DDB_LOCK:
+            if _DDB is None:
+                _DDB = boto3.client('dynamodb', config=_BOTO_CONFIG)
+    return _DDB
+
+# Short-lived per-container LRU of user balances: user_id -> (cached_at, tokens).
+# Only used for display; purchases are authorized by a conditional write instead.
+_TOKENS_CACHE = OrderedDict()
+_TOKENS_CACHE_LOCK = threading.Lock()
+_TOKENS_CACHE_TTL = 30.0
+_TOKENS_CACHE_MAX = 1024
+
+def _cached_tokens(user_id):
+    with _TOKENS_CACHE_LOCK:
+        cached = _TOKENS_CACHE.get(user_id)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= _TOKENS_CACHE_TTL:
+            del _TOKENS_CACHE[user_id]
+            return None
+        _TOKENS_CACHE.move_to_end(user_id)
+        return cached[1]
+
+def _cache_tokens(user_id, tokens):
+    with _TOKENS_CACHE_LOCK:
+        _TOKENS_CACHE[user_id] = (time.monotonic(), tokens)
+        _TOKENS_CACHE.move_to_end(user_id)
+        while len(_TOKENS_CACHE) > _TOKENS_CACHE_MAX:
+            _TOKENS_CACHE.popitem(last=False)
+
+def _uncache_tokens(user_id):
+    with _TOKENS_CACHE_LOCK:
+        _TOKENS_CACHE.pop(user_id, None)
+
+# Shared HTTP session so warm containers reuse pooled TLS connections to Discord/OpenAI.
+# Only global headers go here; Authorization is passed per call so the bot token
+# never reaches OpenAI or the interaction callback.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+))
+# Command registration is an idempotent upsert, so it alone may retry POSTs;
+# urllib3 honours Retry-After (seconds or HTTP-date) on 429 responses.
+_SESSION.mount("https://discord.com/api/v10/applications/", HTTPAdapter(
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        allowed_methods=["POST"]
+    )
+))
+_SESSION.headers["User-Agent"] = "CASproject-bot (https://github.com/NoelVFX/CASproject, 1.0)"
+
+# Hosts OpenAI can fetch from directly, so their images need not pass through Lambda
+_OPENAI_FETCHABLE_HOSTS = frozenset({"cdn.discordapp.com", "media.discordapp.net"})
+
+# Attachment URLs are user supplied, so cap what we are willing to buffer
+_MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+# Some image hosts reject non-browser clients
+_UA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# Worker pool for overlapping independent I/O; lives across warm invocations.
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+# (connect, read) timeouts so a stalled peer can't hold the invocation open.
+# OpenAI sends nothing until the whole completion is ready, so it gets a longer read.
+_TIMEOUT = (3.0, 8.0)
+_OPENAI_TIMEOUT = (3.0, 30.0)
+# Roughly the p95 of an image completion; only slower calls get a backup request
+_OPENAI_HEDGE_DELAY = 10.0
+_OPENAI_URL = "https://api.openai.com/v1/chat/completions"
 
 def handle_command(body_json, interaction_id, interaction_token):
     try:
         command = body_json.get('data', {}).get('name')
-        if command == 'balance':
-            return balance_command(body_json, interaction_id, interaction_token)
-        elif command == 'shop':
-            return shop_command(body_json, interaction_id, interaction_token)
-        elif command == 'buy':
-            return buy_command(body_json, interaction_id, interaction_token)
-        elif command == 'submit_image':
-            return submit_image_command(body_json, interaction_id, interaction_token, api_key)
-        else:
-            print(f"Unknown command: {command}")
+        handler = _COMMANDS.get(command)
+        if handler is None:
+            logger.warning("Unknown command: %s", command)
             return error_response(400, 'Unknown command')
+        return handler(body_json, interaction_id, interaction_token)
     except KeyError as e:
-        print(f"KeyError in handle_command: {e}")
+        logger.error("KeyError in handle_command: %s", e)
         return error_response(400, 'Invalid request payload')
     except Exception as e:
-        print(f"Unexpected error in handle_command: {e}")
+        logger.error("Unexpected error in handle_command: %s", e)
         return error_response(500, 'Internal server error')
 
 def error_response(status_code, message):
     return {
         'statusCode': status_code,
-        'body': json.dumps({'error': message}),
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-        }
-    }
-
-def successful_response(body):
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-        },
-        'body': json.dumps(body)
+        'body': orjson.dumps({'error': message}).decode(),
+        'headers': _STD_HEADERS
     }
 
 def lambda_handler(event, context):
+    # Async self-invocation from submit_image_command; never reachable through API Gateway
+    if 'submit_image_job' in event:
+        run_submit_image_job(event['submit_image_job'], api_key)
+        return None
     try:
         headers = event.get('headers', {})
         signature = headers.get("x-signature-ed25519")
         timestamp = headers.get("x-signature-timestamp")
 
-        # Log headers for debugging
-        print(f"Received headers: {headers}")
+        logger.debug("Received headers: %s", headers)
 
         if not signature or not timestamp:
             raise ValueError('Missing signature or timestamp')
 
-        body = event.get('body', '')
+        # Keep the body as the raw wire bytes; Discord signs those, and orjson parses bytes directly
+        body = event.get('body') or b''
+        if isinstance(body, str):
+            body = body.encode()
         if event.get('isBase64Encoded', False):
-            body = base64.b64decode(body).decode('utf-8')
+            body = base64.b64decode(body)
 
-        print(f"Received event: {json.dumps(event)}")
-        print("Body: ", body)
+        logger.debug("Received event: %s", event)
+        logger.debug("Body: %s", body)
 
         try:
-            body_json = json.loads(body)
-        except json.JSONDecodeError:
-            print("Invalid JSON in body")
+            body_json = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            logger.warning("Invalid JSON in body")
             return error_response(400, 'Invalid JSON')
 
-        verify_key = VerifyKey(bytes.fromhex(PUBLIC_KEY))
+        if _PUB_KEY_BYTES is None:
+            logger.error("DISCORD_PUBLIC_KEY is not set")
+            return error_response(500, 'Internal server error')
+        signature_bytes = bytes.fromhex(signature)
+        # crypto_sign_open splits signature and message by offset, so the length must be exact
+        if len(signature_bytes) != crypto_sign_BYTES:
+            logger.warning("Invalid request signature length")
+            return error_response(401, 'Invalid request signature')
         try:
-            verify_key.verify(f'{timestamp}{body}'.encode(), bytes.fromhex(signature))
+            # Ed25519 check straight through libsodium, without the VerifyKey wrapper
+            crypto_sign_open(signature_bytes + timestamp.encode() + body, _PUB_KEY_BYTES)
         except BadSignatureError:
-            print("Invalid request signature")
+            logger.warning("Invalid request signature")
             return error_response(401, 'Invalid request signature')
 
         # Handle PING request
         if body_json.get('type') == 1:
-            return successful_response({"type": 1})
+            return _PING_RESPONSE
 
         interaction_id = body_json.get('id')
         interaction_token = body_json.get('token')
@@ -102,10 +321,10 @@ def lambda_handler(event, context):
         return handle_command(body_json, interaction_id, interaction_token)
 
     except ValueError as e:
-        print(f"ValueError: {e}")
+        logger.warning("ValueError: %s", e)
         return error_response(400, str(e))
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return error_response(500, 'Internal server error')
 
 def balance_command(body_json, interaction_id, interaction_token):
@@ -119,45 +338,44 @@ def balance_command(body_json, interaction_id, interaction_token):
             }
         })
     except KeyError as e:
-        print(f"KeyError in balance_command: {e}")
+        logger.error("KeyError in balance_command: %s", e)
         return error_response(400, 'Invalid user information')
 
 def shop_command(body_json, interaction_id, interaction_token):
     try:
-        shop_items = {
-            "item1": 10,
-            "item2": 20,
-            "item3": 30
-        }
-        shop_list = "\n".join([f"{item}: {price} tokens" for item, price in shop_items.items()])
         return send_interaction_response(interaction_id, interaction_token, {
             'type': 4,
             'data': {
-                'content': f"**Shop Items:**\n{shop_list}"
+                'content': f"**Shop Items:**\n{_SHOP_LIST_TEXT}"
             }
         })
     except Exception as e:
-        print(f"Error in shop_command: {e}")
+        logger.error("Error in shop_command: %s", e)
         return error_response(500, 'Internal server error')
 
 def buy_command(body_json, interaction_id, interaction_token):
     try:
         user_id = body_json['member']['user']['id']
         item = body_json['data']['options'][0]['value']
-        shop_items = {
-            "item1": 10,
-            "item2": 20,
-            "item3": 30
-        }
-        if item in shop_items:
-            price = shop_items[item]
-            current_tokens = get_user_tokens(user_id)
-            if current_tokens >= price:
-                update_user_tokens(user_id, -price)
+        if item in _SHOP_ITEMS:
+            price = _SHOP_ITEMS[item]
+            # The debit gates everything after it, so run it inline rather than abandoning it
+            # to a frozen thread; botocore's own timeouts bound how long it can take
+            if spend_user_tokens(user_id, price) is not None:
                 message = f"<@{user_id}>, you bought {item} for {price} tokens!"
-                send_dm_with_embed(user_id, item, price)
-            else:
-                message = f"<@{user_id}>, you don't have enough tokens to buy {item}!"
+                # Only a successful purchase opens a DM channel; the DM and the reply run side by side
+                dm_future = _EXECUTOR.submit(send_dm_with_embed, user_id, item, price)
+                response_future = _EXECUTOR.submit(send_interaction_response, interaction_id, interaction_token, {
+                    'type': 4,
+                    'data': {
+                        'content': message
+                    }
+                })
+                # Lambda freezes once we return, so let the DM finish first; the reply is
+                # already in flight, and the session timeouts bound each DM request
+                dm_future.result()
+                return response_future.result()
+            message = f"<@{user_id}>, you don't have enough tokens to buy {item}!"
         else:
             message = f"<@{user_id}>, the item {item} does not exist in the shop."
         return send_interaction_response(interaction_id, interaction_token, {
@@ -167,28 +385,103 @@ def buy_command(body_json, interaction_id, interaction_token):
             }
         })
     except KeyError as e:
-        print(f"KeyError in buy_command: {e}")
+        logger.error("KeyError in buy_command: %s", e)
         return error_response(400, 'Invalid item')
 
 def get_user_tokens(user_id):
+    cached = _cached_tokens(user_id)
+    if cached is not None:
+        return cached
     try:
-        response = users_table.get_item(Key={'user_id': user_id})
-        if 'Item' in response:
-            return response['Item'].get('tokens', 0)
-        return 0
+        response = _ddb().get_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'user_id': {'S': user_id}},
+            ProjectionExpression='tokens'
+        )
+        tokens = int(response.get('Item', {}).get('tokens', {'N': '0'})['N'])
+        _cache_tokens(user_id, tokens)
+        return tokens
     except Exception as e:
-        print(f"Error getting user tokens: {e}")
+        logger.error("Error getting user tokens: %s", e)
         return 0
 
-def update_user_tokens(user_id, amount):
+def credit_submission_tokens(user_id, amount, interaction_id):
+    # Async invocations may be delivered more than once, so the credit records the
+    # interaction it came from and a repeat delivery leaves the balance alone
     try:
-        users_table.update_item(
-            Key={'user_id': user_id},
-            UpdateExpression="SET tokens = if_not_exists(tokens, :zero) + :amount",
-            ExpressionAttributeValues={':amount': amount, ':zero': 0}
+        response = _ddb().update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'user_id': {'S': user_id}},
+            UpdateExpression="SET tokens = if_not_exists(tokens, :zero) + :amount, last_submission = :interaction",
+            ConditionExpression="attribute_not_exists(last_submission) OR last_submission <> :interaction",
+            ExpressionAttributeValues={
+                ':amount': {'N': str(amount)},
+                ':zero': {'N': '0'},
+                ':interaction': {'S': interaction_id}
+            },
+            ReturnValues='UPDATED_NEW'
         )
+    except _ddb().exceptions.ConditionalCheckFailedException:
+        logger.info("Interaction %s was already credited to user %s", interaction_id, user_id)
+        _uncache_tokens(user_id)
+        return get_user_tokens(user_id)
     except Exception as e:
-        print(f"Error updating user tokens: {e}")
+        logger.error("Error crediting user tokens: %s", e)
+        _uncache_tokens(user_id)
+        return None
+    tokens = int(response['Attributes']['tokens']['N'])
+    _cache_tokens(user_id, tokens)
+    return tokens
+
+def spend_user_tokens(user_id, price):
+    # Debits only if the stored balance covers the price; returns the new balance,
+    # or None when the user can't afford it
+    try:
+        response = _ddb().update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'user_id': {'S': user_id}},
+            UpdateExpression="SET tokens = tokens - :price",
+            ConditionExpression="tokens >= :price",
+            ExpressionAttributeValues={':price': {'N': str(price)}},
+            ReturnValues='UPDATED_NEW'
+        )
+    except _ddb().exceptions.ConditionalCheckFailedException:
+        _uncache_tokens(user_id)
+        return None
+    tokens = int(response['Attributes']['tokens']['N'])
+    _cache_tokens(user_id, tokens)
+    return tokens
+
+def get_user_tokens_batch(user_ids):
+    # Fetches many balances with one BatchGetItem per 100 users; missing users have 0 tokens
+    balances = {user_id: 0 for user_id in user_ids}
+    user_ids = list(balances)
+    try:
+        for start in range(0, len(user_ids), _BATCH_GET_LIMIT):
+            request = {
+                DYNAMODB_TABLE_NAME: {
+                    'Keys': [{'user_id': {'S': user_id}} for user_id in user_ids[start:start + _BATCH_GET_LIMIT]],
+                    'ProjectionExpression': 'user_id, tokens'
+                }
+            }
+            # UnprocessedKeys arrive in a 200 response, so botocore won't back off for us
+            for attempt in range(_BATCH_GET_ATTEMPTS):
+                if attempt:
+                    time.sleep(_BATCH_GET_BACKOFF * 2 ** (attempt - 1))
+                response = _ddb().batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []):
+                    user_id = item['user_id']['S']
+                    balances[user_id] = int(item.get('tokens', {'N': '0'})['N'])
+                    _cache_tokens(user_id, balances[user_id])
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+            else:
+                logger.error("Gave up on %s unprocessed keys in batch token lookup",
+                             len(request[DYNAMODB_TABLE_NAME]['Keys']))
+    except Exception as e:
+        logger.error("Error getting user tokens in batch: %s", e)
+    return balances
 
 def send_interaction_response(interaction_id, interaction_token, data):
     url = f"https://discord.com/api/v10/interactions/{interaction_id}/{interaction_token}/callback"
@@ -196,34 +489,46 @@ def send_interaction_response(interaction_id, interaction_token, data):
         "Content-Type": "application/json"
     }
     try:
-        response = requests.post(url, json=data, headers=headers)
+        response = _SESSION.post(url, data=orjson.dumps(data), headers=headers, timeout=_TIMEOUT)
         response.raise_for_status()
         return {
             'statusCode': response.status_code,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-            },
+            'headers': _STD_HEADERS,
             'body': response.text
         }
     except requests.RequestException as e:
-        print(f"Error sending interaction response: {e}")
+        logger.error("Error sending interaction response: %s", e)
         return error_response(500, 'Failed to send interaction response')
 
-def send_dm_with_embed(user_id, item, price):
-    url = f"https://discord.com/api/v10/users/@me/channels"
+def edit_original_response(interaction_token, content):
+    url = f"https://discord.com/api/v10/webhooks/{APPLICATION_ID}/{interaction_token}/messages/@original"
+    headers = {
+        "Content-Type": "application/json"
+    }
+    try:
+        response = _SESSION.patch(url, data=orjson.dumps({'content': content}), headers=headers, timeout=_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error("Error editing original interaction response: %s", e)
+
+def create_dm_channel(user_id):
+    url = "https://discord.com/api/v10/users/@me/channels"
     headers = {
         "Authorization": f"Bot {BOT_TOKEN}",
         "Content-Type": "application/json"
     }
-    payload = {
-        "recipient_id": user_id
+    response = _SESSION.post(url, data=orjson.dumps({"recipient_id": user_id}), headers=headers, timeout=_TIMEOUT)
+    response.raise_for_status()
+    return orjson.loads(response.content)['id']
+
+def send_dm_with_embed(user_id, item, price):
+    headers = {
+        "Authorization": f"Bot {BOT_TOKEN}",
+        "Content-Type": "application/json"
     }
     try:
         # Create a DM channel with the user
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        channel_id = response.json()['id']
+        channel_id = create_dm_channel(user_id)
 
         dm_url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
         embed = {
@@ -241,11 +546,11 @@ def send_dm_with_embed(user_id, item, price):
             "embeds": [embed]  # Embeds should be an array
         }
         # Send the DM with the embed
-        dm_response = requests.post(dm_url, json=dm_payload, headers=headers)
+        dm_response = _SESSION.post(dm_url, data=orjson.dumps(dm_payload), headers=headers, timeout=_TIMEOUT)
         dm_response.raise_for_status()
-        print(f"DM sent to user {user_id} with embed: {embed}")
-    except requests.RequestException as e:
-        print(f"Error sending DM with embed to user {user_id}: {e}")
+        logger.info("DM sent to user %s with embed: %s", user_id, embed)
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logger.error("Error sending DM with embed to user %s: %s", user_id, e)
 
 # Note: register_commands() should be run separately during deployment or manually, not within Lambda handler
 
@@ -333,61 +638,127 @@ def register_commands():
         }
 
         for command in commands:
-            while True:
-                response = requests.post(url, json=command, headers=headers)
-                # Handle rate limiting
-                if response.status_code == 429:
-                    retry_after = int(response.headers.get("Retry-After", 1))
-                    print(f"Rate limited. Retrying after {retry_after} seconds.")
-                else:
-                    response.raise_for_status()
-                    print(f"Command '{command['name']}' registered successfully")
-                    break
+            # Rate limiting is retried by the session's adapter
+            response = _SESSION.post(url, data=orjson.dumps(command), headers=headers, timeout=_TIMEOUT)
+            response.raise_for_status()
+            logger.info("Command '%s' registered successfully", command['name'])
 
     except ValueError as e:
-        print(f"Configuration error: {e}")
+        logger.error("Configuration error: %s", e)
     except requests.RequestException as e:
-        print(f"Error registering commands: {e}")
+        logger.error("Error registering commands: %s", e)
 
 def encode_image(image_bytes):
-    return base64.b64encode(image_bytes).decode('utf-8')
+    # Kept as bytes; the caller decodes the finished data URL once
+    return base64.b64encode(image_bytes)
 
 def download_image(url):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-    try:
-        response = requests.get(url, headers=headers)
+    # Transient failures are retried by the session's adapter
+    with _SESSION.get(url, headers=_UA_HEADERS, stream=True, timeout=_TIMEOUT) as response:
         response.raise_for_status()
         if 'image' not in response.headers.get('Content-Type', ''):
             raise ValueError(f"Unexpected content type: {response.headers.get('Content-Type')}")
-        return response.content
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading image with requests: {e}")
-        print(f"Response status code: {response.status_code}")
-        print(f"Response content: {response.text}")
-        
-        # Fallback to urllib
-        return download_image_with_urllib(url)
-
-def download_image_with_urllib(url):
-    import urllib.request
-    from urllib.error import URLError
-
+        length = int(response.headers.get('Content-Length') or 0)
+        if length > _MAX_IMAGE_BYTES:
+            raise ValueError(f"Image too large: {length} bytes")
+        if not length or response.headers.get('Content-Encoding'):
+            # Size unknown up front, so enforce the cap while reading
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                buffer += chunk
+                if len(buffer) > _MAX_IMAGE_BYTES:
+                    raise ValueError(f"Image larger than {_MAX_IMAGE_BYTES} bytes")
+            return buffer
+        # Read straight into a buffer sized from Content-Length
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            count = response.raw.readinto(view[received:])
+            if not count:
+                raise ValueError(f"Image truncated: got {received} of {length} bytes")
+            received += count
+        return buffer
+
+def _post_openai(headers, data):
+    return _SESSION.post(_OPENAI_URL, headers=headers, data=data, timeout=_OPENAI_TIMEOUT)
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def _post_openai_hedged(headers, data):
+    # A backup request goes out only when the first outlives the usual latency, so most
+    # submissions cost one call; after that the first successful reply wins
+    futures = [_EXECUTOR.submit(_post_openai, headers, data)]
+    done, _ = concurrent.futures.wait(futures, timeout=_OPENAI_HEDGE_DELAY)
+    if done:
+        return futures[0].result()
+    futures.append(_EXECUTOR.submit(_post_openai, headers, data))
+    failure = None
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            response = future.result()
+        except requests.RequestException as e:
+            failure = e
+            continue
+        if not response.ok:
+            failure = response
+            continue
+        # The other request can't be recalled once sent; release its connection when it lands
+        for other in futures:
+            if other is not future:
+                other.add_done_callback(_close_response)
+        return response
+    if isinstance(failure, requests.Response):
+        # Hand the error response back so the caller's raise_for_status reports it
+        return failure
+    raise failure
+
+def submit_image_command(body_json, interaction_id, interaction_token):
     try:
-        with urllib.request.urlopen(url) as response:
-            return response.read()
-    except URLError as e:
-        print(f"Error downloading image with urllib: {e}")
-        raise
+        job = {
+            'user_id': body_json['member']['user']['id'],
+            'attachment_url': body_json['data']['options'][0]['value'],
+            'interaction_id': interaction_id,
+            'interaction_token': interaction_token
+        }
+    except KeyError as e:
+        logger.error("KeyError in submit_image_command: %s", e)
+        return error_response(400, 'Invalid request payload')
 
-def submit_image_command(body_json, interaction_id, interaction_token, api_key):
+    # Analysis outlasts Discord's 3 second window, so defer now and finish in a separate
+    # async invocation; this one returns (and is frozen) as soon as the ack is sent.
+    response = send_interaction_response(interaction_id, interaction_token, {'type': 5})
+    if response['statusCode'] >= 400:
+        return response
     try:
-        user_id = body_json['member']['user']['id']
-        attachment_url = body_json['data']['options'][0]['value']
+        _lambda_client().invoke(
+            FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+            InvocationType='Event',
+            Payload=orjson.dumps({'submit_image_job': job})
+        )
+    except Exception as e:
+        logger.error("Error starting submit_image job: %s", e)
+        edit_original_response(interaction_token, 'Failed to analyze the image')
+    return response
+
+def run_submit_image_job(job, api_key):
+    user_id = job['user_id']
+    attachment_url = job['attachment_url']
+    interaction_id = job['interaction_id']
+    interaction_token = job['interaction_token']
+    try:
+        # Build the DynamoDB client on a cold container while the image and OpenAI calls run
+        _EXECUTOR.submit(_ddb)
       
-        image_bytes = download_image(attachment_url)
-        base64_image = encode_image(image_bytes)
+        parsed_url = urlparse(attachment_url)
+        if parsed_url.scheme == 'https' and parsed_url.hostname in _OPENAI_FETCHABLE_HOSTS:
+            image_url = attachment_url
+        else:
+            image_bytes = download_image(attachment_url)
+            image_url = (b"data:image/jpeg;base64," + encode_image(image_bytes)).decode('ascii')
+            del image_bytes
       
         headers = {
             "Content-Type": "application/json",
@@ -402,74 +773,12 @@ def submit_image_command(body_json, interaction_id, interaction_token, api_key):
                     "content": [
                         {
                             "type": "text",
-                            "text": (
-                                "Determine the waste in this image and provide the respective tokens to the user:\n\n"
-                                "Plastic Waste (1 token):\n"
-                                "Plastic bottles\n"
-                                "Plastic bags\n"
-                                "Food packaging\n"
-                                "Straws\n\n"
-                                "Paper Waste (1 token):\n"
-                                "Newspapers\n"
-                                "Magazines\n"
-                                "Office paper\n"
-                                "Cardboard\n\n"
-                                "Glass Waste (2 tokens):\n"
-                                "Glass bottles\n"
-                                "Jars\n"
-                                "Broken glass\n\n"
-                                "Metal Waste (3 tokens):\n"
-                                "Aluminum cans\n"
-                                "Tin cans\n"
-                                "Scrap metal\n\n"
-                                "Organic Waste (1 token):\n"
-                                "Food scraps\n"
-                                "Fruit and vegetable peels\n"
-                                "Coffee grounds\n"
-                                "Yard clippings\n\n"
-                                "Textile Waste (2 tokens):\n"
-                                "Old clothes\n"
-                                "Fabric scraps\n"
-                                "Shoes\n\n"
-                                "Electronic Waste (E-Waste) (4 tokens):\n"
-                                "Old phones\n"
-                                "Computers\n"
-                                "Batteries\n"
-                                "Chargers\n\n"
-                                "Wood Waste (2 tokens):\n"
-                                "Furniture\n"
-                                "Wooden pallets\n"
-                                "Tree branches\n\n"
-                                "Rubber Waste (3 tokens):\n"
-                                "Old tires\n"
-                                "Rubber bands\n"
-                                "Rubber mats\n\n"
-                                "Ceramic Waste (2 tokens):\n"
-                                "Broken dishes\n"
-                                "Tiles\n"
-                                "Pottery\n\n"
-                                "Composite Waste (2 tokens):\n"
-                                "Tetra packs (juice boxes)\n"
-                                "Mixed-material packaging\n\n"
-                                "Hazardous Household Waste (5 tokens):\n"
-                                "Paints and solvents\n"
-                                "Pesticides\n"
-                                "Cleaning agents\n"
-                                "Fluorescent bulbs\n\n"
-                                "Medical Waste (4 tokens):\n"
-                                "Used bandages\n"
-                                "Syringes\n"
-                                "Expired medications\n\n"
-                                "Miscellaneous Waste (1 token):\n"
-                                "Disposable diapers\n"
-                                "Cigarette butts\n"
-                                "Styrofoam product"
-                            )
+                            "text": _SUBMIT_IMAGE_PROMPT
                         },
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": image_url
                             }
                         }
                     ]
@@ -477,57 +786,46 @@ def submit_image_command(body_json, interaction_id, interaction_token, api_key):
             ],
             "max_tokens": 300
         }
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        response = _post_openai_hedged(headers, orjson.dumps(payload))
         response.raise_for_status()
       
-        result = response.json()
+        result = orjson.loads(response.content)
         description = result['choices'][0]['message']['content']
         
         # Extract token amount from the description
         token_amount = extract_tokens_from_description(description)
-        update_user_tokens(user_id, token_amount)
-        new_balance = get_user_tokens(user_id)
+        new_balance = credit_submission_tokens(user_id, token_amount, interaction_id)
+        if new_balance is None:
+            new_balance = get_user_tokens(user_id)
         
-        return send_interaction_response(interaction_id, interaction_token, {
-            'type': 4,
-            'data': {
-                'content': f"<@{user_id}>, here is what I found in the image:\n{description}\nYou have earned {token_amount} tokens. Your new balance is {new_balance} tokens."
-            }
-        })
+        edit_original_response(
+            interaction_token,
+            f"<@{user_id}>, here is what I found in the image:\n{description}\nYou have earned {token_amount} tokens. Your new balance is {new_balance} tokens."
+        )
     except requests.exceptions.HTTPError as e:
-        print(f"HTTP error during API call: {e}")
-        print(f"Response content: {e.response.text}")
-        return error_response(500, 'Failed to analyze the image')
+        logger.error("HTTP error during API call: %s", e)
+        logger.error("Response content: %s", e.response.text)
+        edit_original_response(interaction_token, 'Failed to analyze the image')
     except requests.exceptions.RequestException as e:
-        print(f"Error during API call: {e}")
-        return error_response(500, 'Failed to analyze the image')
+        logger.error("Error during API call: %s", e)
+        edit_original_response(interaction_token, 'Failed to analyze the image')
     except KeyError as e:
-        print(f"Error in API response structure: {e}")
-        return error_response(500, 'Failed to process the image')
+        logger.error("Error in API response structure: %s", e)
+        edit_original_response(interaction_token, 'Failed to process the image')
     except Exception as e:
-        print(f"Unhandled error in submit_image_command: {e}")
-        return error_response(500, 'Failed to analyze the image')
+        logger.error("Unhandled error in run_submit_image_job: %s", e)
+        edit_original_response(interaction_token, 'Failed to analyze the image')
 
 def extract_tokens_from_description(description):
     # This function should parse the description and determine the total tokens earned based on the waste types
-    token_amount = 0
-    token_mapping = {
-        "Plastic": 1,
-        "Paper": 1,
-        "Glass": 2,
-        "Metal": 3,
-        "Organic": 1,
-        "Textile": 2,
-        "Electronic": 4,
-        "Wood": 2,
-        "Rubber": 3,
-        "Ceramic": 2,
-        "Composite": 2,
-        "Hazardous": 5,
-        "Medical": 4,
-        "Miscellaneous": 1
-    }
-    for waste_type, tokens in token_mapping.items():
-        if waste_type in description:
-            token_amount += tokens
-    return token_amount
\ No newline at end of file
+    # Each waste type is counted at most once
+    found = {match.group(1) for match in _WASTE_RE.finditer(description)}
+    return sum(_TOKEN_MAPPING[waste_type] for waste_type in found)
+
+# Command name -> handler; defined last so every handler above already exists
+_COMMANDS = {
+    'balance': balance_command,
+    'shop': shop_command,
+    'buy': buy_command,
+    'submit_image': submit_image_command,
+}
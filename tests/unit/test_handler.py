@@ -1,6 +1,9 @@
 import json
+import threading
+from types import SimpleNamespace
 
 import pytest
+from nacl.signing import SigningKey
 
 from hello_world import app
 
@@ -70,3 +73,221 @@ def test_lambda_handler(apigw_event, mocker):
     assert ret["statusCode"] == 200
     assert "message" in ret["body"]
     assert data["message"] == "hello world"
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class StubDynamoDB:
+    """ Minimal stand-in for the low-level DynamoDB client"""
+
+    def __init__(self, balance):
+        self.balance = balance
+        self.exceptions = SimpleNamespace(ConditionalCheckFailedException=ConditionalCheckFailedException)
+
+    def update_item(self, **kwargs):
+        price = int(kwargs["ExpressionAttributeValues"][":price"]["N"])
+        if self.balance < price:
+            raise ConditionalCheckFailedException()
+        self.balance -= price
+        return {"Attributes": {"tokens": {"N": str(self.balance)}}}
+
+
+def test_spend_user_tokens_rejects_insufficient_balance(mocker):
+    ddb = StubDynamoDB(balance=15)
+    mocker.patch.object(app, "_ddb", return_value=ddb)
+
+    assert app.spend_user_tokens("user", 20) is None
+    assert app.spend_user_tokens("user", 10) == 5
+    assert ddb.balance == 5
+
+
+def test_tokens_cache_evicts_least_recently_used(mocker):
+    mocker.patch.object(app, "_TOKENS_CACHE_MAX", 2)
+    mocker.patch.object(app, "_TOKENS_CACHE", app.OrderedDict())
+
+    app._cache_tokens("a", 1)
+    app._cache_tokens("b", 2)
+    assert app._cached_tokens("a") == 1
+    app._cache_tokens("c", 3)
+
+    assert app._cached_tokens("b") is None
+    assert app._cached_tokens("a") == 1
+    assert app._cached_tokens("c") == 3
+
+
+class StubImageResponse:
+    """ Streaming response stand-in for download_image"""
+
+    def __init__(self, headers, chunks=()):
+        self.headers = headers
+        self.chunks = chunks
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+
+def test_download_image_rejects_oversized_content_length(mocker):
+    response = StubImageResponse({"Content-Type": "image/png", "Content-Length": str(app._MAX_IMAGE_BYTES + 1)})
+    mocker.patch.object(app._SESSION, "get", return_value=response)
+
+    with pytest.raises(ValueError):
+        app.download_image("https://example.com/huge.png")
+    assert response.closed
+
+
+def test_download_image_caps_unsized_body(mocker):
+    chunk = b"x" * (app._MAX_IMAGE_BYTES // 2 + 1)
+    response = StubImageResponse({"Content-Type": "image/png"}, chunks=[chunk, chunk])
+    mocker.patch.object(app._SESSION, "get", return_value=response)
+
+    with pytest.raises(ValueError):
+        app.download_image("https://example.com/huge.png")
+
+
+@pytest.mark.parametrize(
+    "description, expected",
+    [
+        ("Plastic bottle and a Glass jar", 3),
+        ("Electronics and Plastics", 5),
+        ("Metals, Textiles", 5),
+        ("Plastic, more Plastic and Plastics", 1),
+        ("Glasses", 2),
+        ("Wooden pallets", 2),
+        ("Metallic scrap", 3),
+        ("Paperwork on the desk", 1),
+        ("Nothing recyclable here", 0),
+    ],
+)
+def test_extract_tokens_from_description(description, expected):
+    assert app.extract_tokens_from_description(description) == expected
+
+
+def test_get_user_tokens_batch_retries_unprocessed_keys(mocker):
+    table = app.DYNAMODB_TABLE_NAME
+    ddb = mocker.Mock()
+    ddb.batch_get_item.side_effect = [
+        {
+            "Responses": {table: [{"user_id": {"S": "a"}, "tokens": {"N": "7"}}]},
+            "UnprocessedKeys": {table: {"Keys": [{"user_id": {"S": "b"}}]}},
+        },
+        {
+            "Responses": {table: [{"user_id": {"S": "b"}, "tokens": {"N": "3"}}]},
+            "UnprocessedKeys": {},
+        },
+    ]
+    mocker.patch.object(app, "_ddb", return_value=ddb)
+    sleep = mocker.patch.object(app.time, "sleep")
+
+    assert app.get_user_tokens_batch(["a", "b", "c"]) == {"a": 7, "b": 3, "c": 0}
+    assert ddb.batch_get_item.call_count == 2
+    assert ddb.batch_get_item.call_args.kwargs["RequestItems"] == {table: {"Keys": [{"user_id": {"S": "b"}}]}}
+    sleep.assert_called_once_with(app._BATCH_GET_BACKOFF)
+
+
+def test_get_user_tokens_batch_gives_up_after_bounded_attempts(mocker):
+    table = app.DYNAMODB_TABLE_NAME
+    ddb = mocker.Mock()
+    ddb.batch_get_item.return_value = {
+        "Responses": {table: []},
+        "UnprocessedKeys": {table: {"Keys": [{"user_id": {"S": "a"}}]}},
+    }
+    mocker.patch.object(app, "_ddb", return_value=ddb)
+    mocker.patch.object(app.time, "sleep")
+
+    assert app.get_user_tokens_batch(["a"]) == {"a": 0}
+    assert ddb.batch_get_item.call_count == app._BATCH_GET_ATTEMPTS
+
+
+@pytest.fixture()
+def signing_key(mocker):
+    """ Signs interactions with a throwaway key the handler trusts"""
+    key = SigningKey.generate()
+    mocker.patch.object(app, "_PUB_KEY_BYTES", bytes(key.verify_key))
+    return key
+
+
+def signed_event(signing_key, body, timestamp="1700000000"):
+    signature = signing_key.sign(timestamp.encode() + body.encode()).signature.hex()
+    return {
+        "headers": {"x-signature-ed25519": signature, "x-signature-timestamp": timestamp},
+        "body": body,
+    }
+
+
+def test_lambda_handler_accepts_valid_signature(signing_key):
+    ret = app.lambda_handler(signed_event(signing_key, '{"type": 1}'), "")
+
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"]) == {"type": 1}
+
+
+def test_lambda_handler_rejects_tampered_body(signing_key):
+    event = signed_event(signing_key, '{"type": 1}')
+    event["body"] = '{"type": 2}'
+
+    assert app.lambda_handler(event, "")["statusCode"] == 401
+
+
+def test_lambda_handler_rejects_short_signature(signing_key):
+    event = signed_event(signing_key, '{"type": 1}')
+    event["headers"]["x-signature-ed25519"] = event["headers"]["x-signature-ed25519"][:64]
+
+    assert app.lambda_handler(event, "")["statusCode"] == 401
+
+
+def openai_response(status_code):
+    response = app.requests.Response()
+    response.status_code = status_code
+    return response
+
+
+def test_post_openai_hedged_sends_one_request_when_fast(mocker):
+    post = mocker.patch.object(app, "_post_openai", return_value=openai_response(200))
+
+    assert app._post_openai_hedged({}, b"{}").status_code == 200
+    assert post.call_count == 1
+
+
+def test_post_openai_hedged_prefers_slow_success_over_fast_error(mocker):
+    release = threading.Event()
+
+    def slow_success(headers, data):
+        release.wait(5)
+        return openai_response(200)
+
+    def fast_rate_limit(headers, data):
+        release.set()
+        return openai_response(429)
+
+    mocker.patch.object(app, "_OPENAI_HEDGE_DELAY", 0.01)
+    calls = iter([slow_success, fast_rate_limit])
+    mocker.patch.object(app, "_post_openai", side_effect=lambda headers, data: next(calls)(headers, data))
+
+    assert app._post_openai_hedged({}, b"{}").status_code == 200
+
+
+def test_credit_submission_tokens_ignores_repeat_delivery(mocker):
+    ddb = mocker.Mock()
+    ddb.exceptions = SimpleNamespace(ConditionalCheckFailedException=ConditionalCheckFailedException)
+    ddb.update_item.side_effect = [
+        {"Attributes": {"tokens": {"N": "12"}}},
+        ConditionalCheckFailedException(),
+    ]
+    ddb.get_item.return_value = {"Item": {"tokens": {"N": "12"}}}
+    mocker.patch.object(app, "_ddb", return_value=ddb)
+
+    assert app.credit_submission_tokens("user", 2, "interaction") == 12
+    assert app.credit_submission_tokens("user", 2, "interaction") == 12
+    assert ddb.update_item.call_args.kwargs["ExpressionAttributeValues"][":interaction"] == {"S": "interaction"}